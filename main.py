@@ -1,8 +1,13 @@
 import logging
-import json
+import orjson
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Dict, List
 import sqlite3
+import aiosqlite
 import os
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler
@@ -27,16 +32,399 @@ logger = logging.getLogger(__name__)
 # Conversation states
 PATIENT_NAME, PATIENT_AGE, PATIENT_PHONE, PATIENT_DIAGNOSIS, PRESCRIPTION_INPUT, CONFIRM_PRESCRIPTION = range(6)
 
+@dataclass(slots=True)
+class AddPatientState:
+    """In-memory state for the add-patient conversation; slotted so each
+    in-flight conversation costs fixed attribute storage instead of dict
+    entries"""
+    name: str = ""
+    age: int = 0
+    phone: str = ""
+
+
+# H. pylori quadruple-therapy template: immutable shared data, so it is
+# built once at import with its JSON serialization precomputed
+_HPYLORI_MEDS = (
+    {
+        "name": "Doxycycline 100mg",
+        "dosage": "100mg",
+        "quantity": "28 tablets",
+        "instructions": "Take 1 tablet twice daily (morning and evening) after meals for 14 days"
+    },
+    {
+        "name": "Metronidazole 500mg",
+        "dosage": "500mg",
+        "quantity": "42 tablets",
+        "instructions": "Take 1 tablet three times daily (morning, lunch, evening) after meals for 14 days"
+    },
+    {
+        "name": "Esomeprazole 40mg",
+        "dosage": "40mg",
+        "quantity": "28 tablets",
+        "instructions": "Take 1 tablet twice daily (morning and evening) before meals for 14 days"
+    },
+    {
+        "name": "Bismuth 525mg",
+        "dosage": "525mg",
+        "quantity": "56 tablets",
+        "instructions": "Take 1 tablet four times daily (morning, lunch, evening, bedtime) with meals for 14 days"
+    }
+)
+_HPYLORI_JSON = orjson.dumps(_HPYLORI_MEDS).decode()
+
+# Pattern for the trailing patient ID in selection buttons like
+# "Name (Age: 30) - ID: 7", compiled once at import
+_ID_RE = re.compile(r'ID:\s*(\d+)\s*$')
+
+# SQL hoisted to module level: handlers always pass the same string objects,
+# so the pooled connections' prepared-statement caches keep the compiled
+# statements across requests
+SQL_INSERT_PATIENT = '''
+    INSERT INTO patients (name, age, phone, telegram_user_id)
+    VALUES (?, ?, ?, ?)
+'''
+
+SQL_INSERT_RX = '''
+    INSERT INTO prescriptions (patient_id, telegram_user_id, diagnosis, admission_date, discharge_date, medications, med_count)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+SQL_INSERT_MEDICATIONS = '''
+    INSERT INTO medications (rx_id, name, dosage, quantity, instructions)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+SQL_RECENT_PATIENTS = '''
+    SELECT id, name, age FROM patients
+    WHERE telegram_user_id = ?
+    ORDER BY created_at DESC LIMIT 10
+'''
+
+SQL_PATIENT_DETAILS = 'SELECT name, age FROM patients WHERE id = ?'
+
+# Page sizes for the paginated list views
+PATIENTS_PAGE = 20
+RX_PAGE = 10
+
+# created_at comes back twice: raw for the pagination cursor and already
+# formatted for display, so Python never builds datetime objects per row
+SQL_LIST_PATIENTS = f'''
+    SELECT id, name, age, phone, created_at,
+           COALESCE(strftime('%d-%m-%Y', created_at), created_at) AS created_date
+    FROM patients
+    WHERE telegram_user_id = ?
+    ORDER BY created_at DESC, id DESC LIMIT {PATIENTS_PAGE}
+'''
+
+# Keyset-paginated variant: 'next page' seeks past the last row seen instead
+# of re-sorting and skipping rows. The cursor compares (created_at, id), not
+# created_at alone: CURRENT_TIMESTAMP has one-second resolution and batched
+# inserts commit together, so boundary rows routinely share a timestamp
+SQL_LIST_PATIENTS_AFTER = f'''
+    SELECT id, name, age, phone, created_at,
+           COALESCE(strftime('%d-%m-%Y', created_at), created_at) AS created_date
+    FROM patients
+    WHERE telegram_user_id = ? AND (created_at, id) < (?, ?)
+    ORDER BY created_at DESC, id DESC LIMIT {PATIENTS_PAGE}
+'''
+
+SQL_LIST_RX = f'''
+    SELECT p.id, pt.name, p.diagnosis, p.admission_date,
+           COALESCE(p.med_count, json_array_length(p.medications)) AS med_count,
+           p.created_at
+    FROM prescriptions p
+    JOIN patients pt ON p.patient_id = pt.id
+    WHERE p.telegram_user_id = ?
+    ORDER BY p.created_at DESC, p.id DESC LIMIT {RX_PAGE}
+'''
+
+SQL_LIST_RX_AFTER = f'''
+    SELECT p.id, pt.name, p.diagnosis, p.admission_date,
+           COALESCE(p.med_count, json_array_length(p.medications)) AS med_count,
+           p.created_at
+    FROM prescriptions p
+    JOIN patients pt ON p.patient_id = pt.id
+    WHERE p.telegram_user_id = ? AND (p.created_at, p.id) < (?, ?)
+    ORDER BY p.created_at DESC, p.id DESC LIMIT {RX_PAGE}
+'''
+
+SQL_SEARCH = '''
+    SELECT p.id, p.name, p.age, p.phone
+    FROM patients_fts f
+    JOIN patients p ON p.id = f.rowid
+    WHERE patients_fts MATCH ? AND p.telegram_user_id = ?
+'''
+
+SQL_STATS = '''
+    SELECT
+        (SELECT COUNT(*) FROM patients WHERE telegram_user_id = ?1) AS patient_count,
+        (SELECT COUNT(*) FROM prescriptions WHERE telegram_user_id = ?1) AS prescription_count,
+        (SELECT COUNT(*) FROM prescriptions
+         WHERE telegram_user_id = ?1 AND DATE(created_at) = ?2) AS today_count
+'''
+
 class MedicalBot:
+    # Static keyboards built once at class definition instead of per call;
+    # python-telegram-bot serializes the same immutable markup each time
+    _MAIN_MENU_MARKUP = ReplyKeyboardMarkup([
+        ['👤 Add New Patient', '📋 View Patients'],
+        ['💊 Create Prescription', '📊 View Prescriptions'],
+        ['🔍 Search Patient', '📈 Statistics']
+    ], resize_keyboard=True)
+    _AFTER_PATIENT_MARKUP = ReplyKeyboardMarkup(
+        [['💊 Create Prescription', '🏠 Main Menu']], resize_keyboard=True)
+    _NO_PATIENTS_MARKUP = ReplyKeyboardMarkup(
+        [['👤 Add New Patient', '🏠 Main Menu']], resize_keyboard=True)
+    _CONFIRM_MARKUP = ReplyKeyboardMarkup(
+        [['✅ Confirm & Save', '❌ Cancel', '✏️ Edit']], resize_keyboard=True)
+    _AFTER_SAVE_MARKUP = ReplyKeyboardMarkup(
+        [['🏠 Main Menu', '💊 New Prescription']], resize_keyboard=True)
+
+    # Number of pooled read connections (writes go through a single connection)
+    READ_POOL_SIZE = 4
+
+    # Applied to every connection: WAL lets readers run concurrently with the
+    # writer, synchronous=NORMAL drops the extra fsync per commit, and the
+    # cache/mmap settings keep hot pages in memory across requests
+    DB_PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-20000",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA busy_timeout=30000",
+    )
+
+    # How long cached query results stay fresh; writes invalidate early
+    CACHE_TTL = 10.0
+
+    # Attempts per write transaction when the database is locked
+    WRITE_RETRIES = 3
+
+    # Write-behind batching: flush queued writes after this many rows or
+    # this much time, whichever comes first
+    WRITE_BATCH_MAX = 64
+    WRITE_BATCH_WINDOW = 0.05
+
     def __init__(self, token: str):
         self.token = token
         self.db_path = "medical_records.db"
         self.init_database()
-        
+
+        # Async connection pool (opened lazily on first use so connections
+        # are created on the running event loop)
+        self._write_conn = None
+        self._read_pool = None
+        self._write_lock = asyncio.Lock()
+        self._pool_lock = asyncio.Lock()
+        self._write_queue = None
+        self._writer_task = None
+
+        # Short-TTL cache for repeated reads, keyed by (telegram_user_id, query_name)
+        self._cache = {}
+
+        # patient_id -> (name, age), for the prescription confirm/edit cycle;
+        # patient rows are never updated so entries stay valid
+        self._patient_name_cache = {}
+
         # Initialize Flask for webhook
         self.app = Flask(__name__)
         self.setup_flask_routes()
 
+    async def _ensure_pool(self):
+        """Open the write connection and reader pool on first use.
+
+        Keeping connections alive across requests preserves SQLite's
+        per-connection page cache instead of rebuilding it on every handler
+        call.
+        """
+        if self._read_pool is not None:
+            return
+        async with self._pool_lock:
+            if self._read_pool is not None:
+                return
+            self._write_conn = await self._open_connection()
+            pool = asyncio.Queue()
+            for _ in range(self.READ_POOL_SIZE):
+                await pool.put(await self._open_connection())
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+            self._read_pool = pool
+
+    async def _open_connection(self):
+        """Open an aiosqlite connection with the tuning pragmas applied"""
+        conn = await aiosqlite.connect(self.db_path, isolation_level=None)
+        for pragma in self.DB_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    @asynccontextmanager
+    async def _acquire_read(self):
+        """Borrow a read connection from the pool and return it afterwards"""
+        await self._ensure_pool()
+        conn = await self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            await self._read_pool.put(conn)
+
+    async def _write_transaction(self, work):
+        """Run work(conn) on the write connection inside BEGIN IMMEDIATE ... COMMIT.
+
+        Taking the write lock up front (instead of letting sqlite upgrade a
+        deferred transaction at commit time) avoids SQLITE_BUSY lock-upgrade
+        failures; 'database is locked' errors are retried with a short backoff.
+        """
+        await self._ensure_pool()
+        async with self._write_lock:
+            for attempt in range(self.WRITE_RETRIES):
+                try:
+                    await self._write_conn.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError as exc:
+                    if 'database is locked' in str(exc) and attempt + 1 < self.WRITE_RETRIES:
+                        await asyncio.sleep(0.05 * (attempt + 1))
+                        continue
+                    raise
+                try:
+                    result = await work(self._write_conn)
+                    await self._write_conn.execute("COMMIT")
+                    return result
+                except sqlite3.OperationalError as exc:
+                    await self._write_conn.execute("ROLLBACK")
+                    if 'database is locked' in str(exc) and attempt + 1 < self.WRITE_RETRIES:
+                        await asyncio.sleep(0.05 * (attempt + 1))
+                        continue
+                    raise
+                except BaseException:
+                    # BaseException so CancelledError (e.g. the writer task
+                    # being cancelled at shutdown) also rolls back instead of
+                    # leaving the connection inside an open transaction
+                    await self._write_conn.execute("ROLLBACK")
+                    raise
+
+    async def _queue_write(self, sql, params):
+        """Hand a write to the batching writer task and wait for its lastrowid"""
+        await self._ensure_pool()
+        future = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((sql, params, future))
+        return await future
+
+    async def _writer_loop(self):
+        """Drain queued writes in batches, one transaction (and fsync) per batch.
+
+        Collects up to WRITE_BATCH_MAX pending writes or whatever arrives
+        within WRITE_BATCH_WINDOW of the first one, then commits them
+        together and resolves each caller's future with its lastrowid.
+        """
+        while True:
+            batch = [await self._write_queue.get()]
+            deadline = time.monotonic() + self.WRITE_BATCH_WINDOW
+            while len(batch) < self.WRITE_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._write_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            async def run_batch(conn):
+                row_ids = []
+                for sql, params, _ in batch:
+                    cursor = await conn.execute(sql, params)
+                    row_ids.append(cursor.lastrowid)
+                return row_ids
+
+            try:
+                row_ids = await self._write_transaction(run_batch)
+            except Exception as exc:
+                logger.error(f"Batched write failed: {exc}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            for (_, _, future), row_id in zip(batch, row_ids):
+                if not future.done():
+                    future.set_result(row_id)
+
+    async def close(self):
+        """Close the pooled connections so their worker threads can exit.
+
+        aiosqlite runs each connection on a thread that only stops once
+        close() is awaited; leaving them open makes the interpreter hang at
+        shutdown waiting to join those threads.
+        """
+        if self._read_pool is None:
+            return
+
+        # Stop the batching writer first, then commit whatever it had not
+        # picked up yet so queued inserts aren't dropped on shutdown
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        await self._flush_write_queue()
+
+        pool, self._read_pool = self._read_pool, None
+        while not pool.empty():
+            await pool.get_nowait().close()
+        if self._write_conn is not None:
+            await self._write_conn.close()
+            self._write_conn = None
+
+    async def _flush_write_queue(self):
+        """Run any writes still queued behind the (stopped) writer task"""
+        if self._write_queue is None:
+            return
+        queue, self._write_queue = self._write_queue, None
+        pending = []
+        while not queue.empty():
+            pending.append(queue.get_nowait())
+        if not pending:
+            return
+
+        async def run_pending(conn):
+            row_ids = []
+            for sql, params, _ in pending:
+                cursor = await conn.execute(sql, params)
+                row_ids.append(cursor.lastrowid)
+            return row_ids
+
+        try:
+            row_ids = await self._write_transaction(run_pending)
+        except Exception as exc:
+            logger.error(f"Flushing queued writes failed: {exc}")
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            for (_, _, future), row_id in zip(pending, row_ids):
+                if not future.done():
+                    future.set_result(row_id)
+
+    async def _on_shutdown(self, application):
+        """PTB post_shutdown hook: release the database connections"""
+        await self.close()
+
+    async def _cached(self, key, ttl, loader):
+        """Return the cached value for key, refreshing via loader() when stale"""
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is not None and now - entry[0] < ttl:
+            return entry[1]
+        value = await loader()
+        self._cache[key] = (now, value)
+        return value
+
+    def _invalidate_user_cache(self, user_id):
+        """Drop cached results for one user, e.g. after an INSERT"""
+        for key in [key for key in self._cache if key[0] == user_id]:
+            del self._cache[key]
+
     def setup_flask_routes(self):
         """Setup Flask routes for webhook"""
         @self.app.route('/', methods=['GET'])
@@ -48,7 +436,7 @@ class MedicalBot:
             """Handle webhook updates from Telegram"""
             try:
                 json_string = request.get_data().decode('utf-8')
-                update = Update.de_json(json.loads(json_string), self.application.bot)
+                update = Update.de_json(orjson.loads(json_string), self.application.bot)
                 
                 # Create new event loop for this thread if needed
                 try:
@@ -161,6 +549,11 @@ class MedicalBot:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
+        # WAL keeps writers from blocking readers; the remaining pragmas are
+        # the same tuning applied to the pooled connections
+        for pragma in self.DB_PRAGMAS:
+            cursor.execute(pragma)
+
         # Patients table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS patients (
@@ -178,27 +571,104 @@ class MedicalBot:
             CREATE TABLE IF NOT EXISTS prescriptions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 patient_id INTEGER,
+                telegram_user_id INTEGER, -- denormalized from patients for read paths
                 diagnosis TEXT,
                 admission_date DATE,
                 discharge_date DATE,
                 medications TEXT, -- JSON string of medications
+                med_count INTEGER, -- number of medications, cached for display
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (patient_id) REFERENCES patients (id)
             )
         ''')
 
+        # Migrate databases created before telegram_user_id lived on
+        # prescriptions, backfilling from the owning patient
+        cursor.execute('PRAGMA table_info(prescriptions)')
+        rx_columns = [row[1] for row in cursor.fetchall()]
+        if 'telegram_user_id' not in rx_columns:
+            cursor.execute('ALTER TABLE prescriptions ADD COLUMN telegram_user_id INTEGER')
+            cursor.execute('''
+                UPDATE prescriptions SET telegram_user_id =
+                    (SELECT telegram_user_id FROM patients WHERE id = prescriptions.patient_id)
+            ''')
+        if 'med_count' not in rx_columns:
+            cursor.execute('ALTER TABLE prescriptions ADD COLUMN med_count INTEGER')
+
+        # Medications table (normalized copy of the prescription's medication
+        # list, written in one batch alongside the JSON blob)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS medications (
+                rx_id INTEGER,
+                name TEXT,
+                dosage TEXT,
+                quantity TEXT,
+                instructions TEXT,
+                FOREIGN KEY (rx_id) REFERENCES prescriptions (id)
+            )
+        ''')
+
+        # Full-text index over patient name/phone so search does an inverted
+        # index lookup instead of a LIKE '%term%' table scan; triggers keep it
+        # in sync with the patients table
+        cursor.execute('''
+            SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'
+        ''')
+        had_fts = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+                name, phone, content='patients', content_rowid='id'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS patients_ai AFTER INSERT ON patients BEGIN
+                INSERT INTO patients_fts(rowid, name, phone)
+                VALUES (new.id, new.name, new.phone);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS patients_ad AFTER DELETE ON patients BEGIN
+                INSERT INTO patients_fts(patients_fts, rowid, name, phone)
+                VALUES ('delete', old.id, old.name, old.phone);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS patients_au AFTER UPDATE ON patients BEGIN
+                INSERT INTO patients_fts(patients_fts, rowid, name, phone)
+                VALUES ('delete', old.id, old.name, old.phone);
+                INSERT INTO patients_fts(rowid, name, phone)
+                VALUES (new.id, new.name, new.phone);
+            END
+        ''')
+        if not had_fts:
+            # Index patients inserted before the FTS table existed
+            cursor.execute("INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')")
+
+        # Indexes matching the handlers' access patterns: every lookup filters
+        # on telegram_user_id and orders by created_at, and handle_search
+        # filters on name case-insensitively
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_patients_user_created
+            ON patients(telegram_user_id, created_at DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_rx_patient
+            ON prescriptions(patient_id, created_at DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_patients_user_name
+            ON patients(telegram_user_id, name COLLATE NOCASE)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_rx_user
+            ON prescriptions(telegram_user_id, created_at DESC)
+        ''')
+
         conn.commit()
         conn.close()
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start command handler"""
-        keyboard = [
-            ['👤 Add New Patient', '📋 View Patients'],
-            ['💊 Create Prescription', '📊 View Prescriptions'],
-            ['🔍 Search Patient', '📈 Statistics']
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
         welcome_text = """
 🏥 **Medical Management Bot**
 
@@ -212,10 +682,11 @@ Welcome to the Medical Bot! I can help you:
 
 Choose an option from the menu below:
 """
-        await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode='Markdown')
+        await update.message.reply_text(welcome_text, reply_markup=self._MAIN_MENU_MARKUP, parse_mode='Markdown')
 
     async def add_patient_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start adding new patient"""
+        context.user_data['add_patient'] = AddPatientState()
         await update.message.reply_text(
             "🏥 **Adding New Patient**\n\nPlease enter the patient's full name:",
             parse_mode='Markdown'
@@ -224,7 +695,7 @@ Choose an option from the menu below:
 
     async def patient_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Get patient name"""
-        context.user_data['patient_name'] = update.message.text
+        context.user_data['add_patient'].name = update.message.text
         await update.message.reply_text(
             f"Patient Name: **{update.message.text}**\n\nPlease enter the patient's age:",
             parse_mode='Markdown'
@@ -235,7 +706,7 @@ Choose an option from the menu below:
         """Get patient age"""
         try:
             age = int(update.message.text)
-            context.user_data['patient_age'] = age
+            context.user_data['add_patient'].age = age
             await update.message.reply_text(
                 f"Age: **{age}** years\n\nPlease enter the patient's phone number:",
                 parse_mode='Markdown'
@@ -247,65 +718,46 @@ Choose an option from the menu below:
 
     async def patient_phone(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Get patient phone and save to database"""
-        context.user_data['patient_phone'] = update.message.text
+        state = context.user_data['add_patient']
+        state.phone = update.message.text
 
         # Save to database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO patients (name, age, phone, telegram_user_id)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            context.user_data['patient_name'],
-            context.user_data['patient_age'],
-            context.user_data['patient_phone'],
+        patient_id = await self._queue_write(SQL_INSERT_PATIENT, (
+            state.name,
+            state.age,
+            state.phone,
             update.effective_user.id
         ))
-
-        patient_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        self._invalidate_user_cache(update.effective_user.id)
+        self._patient_name_cache[patient_id] = (state.name, state.age)
 
         context.user_data['current_patient_id'] = patient_id
 
         summary = f"""
 ✅ **Patient Added Successfully!**
 
-👤 **Name:** {context.user_data['patient_name']}
-🎂 **Age:** {context.user_data['patient_age']} years
-📱 **Phone:** {context.user_data['patient_phone']}
+👤 **Name:** {state.name}
+🎂 **Age:** {state.age} years
+📱 **Phone:** {state.phone}
 🆔 **Patient ID:** {patient_id}
 
 Would you like to create a prescription for this patient?
 """
 
-        keyboard = [['💊 Create Prescription', '🏠 Main Menu']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-        await update.message.reply_text(summary, reply_markup=reply_markup, parse_mode='Markdown')
+        await update.message.reply_text(summary, reply_markup=self._AFTER_PATIENT_MARKUP, parse_mode='Markdown')
         return ConversationHandler.END
 
     async def create_prescription_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start creating prescription"""
         # Get recent patients for selection
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, name, age FROM patients 
-            WHERE telegram_user_id = ? 
-            ORDER BY created_at DESC LIMIT 10
-        ''', (update.effective_user.id,))
-
-        patients = cursor.fetchall()
-        conn.close()
+        async with self._acquire_read() as conn:
+            async with conn.execute(SQL_RECENT_PATIENTS, (update.effective_user.id,)) as cursor:
+                patients = await cursor.fetchall()
 
         if not patients:
-            keyboard = [['👤 Add New Patient', '🏠 Main Menu']]
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
             await update.message.reply_text(
                 "❌ No patients found. Please add a patient first.",
-                reply_markup=reply_markup
+                reply_markup=self._NO_PATIENTS_MARKUP
             )
             return ConversationHandler.END
 
@@ -328,22 +780,21 @@ Would you like to create a prescription for this patient?
         if update.message.text == '🚫 Cancel':
             return await self.cancel(update, context)
 
-        try:
-            # Extract patient ID from selection
-            patient_text = update.message.text
-            patient_id = int(patient_text.split('ID: ')[1])
-            context.user_data['selected_patient_id'] = patient_id
-
-            await update.message.reply_text(
-                "🏥 **Enter Diagnosis:**\n\nExample: Acute gastritis with H. pylori infection",
-                reply_markup=ReplyKeyboardRemove(),
-                parse_mode='Markdown'
-            )
-            return PRESCRIPTION_INPUT
-        except (IndexError, ValueError):
+        # Extract patient ID from selection
+        match = _ID_RE.search(update.message.text)
+        if not match:
             await update.message.reply_text("Please select a patient from the list above.")
             return PATIENT_DIAGNOSIS
 
+        context.user_data['selected_patient_id'] = int(match.group(1))
+
+        await update.message.reply_text(
+            "🏥 **Enter Diagnosis:**\n\nExample: Acute gastritis with H. pylori infection",
+            reply_markup=ReplyKeyboardRemove(),
+            parse_mode='Markdown'
+        )
+        return PRESCRIPTION_INPUT
+
     async def prescription_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Get diagnosis and start prescription input"""
         context.user_data['diagnosis'] = update.message.text
@@ -382,32 +833,7 @@ Please enter your prescription:
 
         # Check for H. pylori template
         if prescription_text == 'h.pylori':
-            medications = [
-                {
-                    "name": "Doxycycline 100mg",
-                    "dosage": "100mg",
-                    "quantity": "28 tablets",
-                    "instructions": "Take 1 tablet twice daily (morning and evening) after meals for 14 days"
-                },
-                {
-                    "name": "Metronidazole 500mg", 
-                    "dosage": "500mg",
-                    "quantity": "42 tablets",
-                    "instructions": "Take 1 tablet three times daily (morning, lunch, evening) after meals for 14 days"
-                },
-                {
-                    "name": "Esomeprazole 40mg",
-                    "dosage": "40mg", 
-                    "quantity": "28 tablets",
-                    "instructions": "Take 1 tablet twice daily (morning and evening) before meals for 14 days"
-                },
-                {
-                    "name": "Bismuth 525mg",
-                    "dosage": "525mg",
-                    "quantity": "56 tablets", 
-                    "instructions": "Take 1 tablet four times daily (morning, lunch, evening, bedtime) with meals for 14 days"
-                }
-            ]
+            medications = _HPYLORI_MEDS
         else:
             # Parse custom prescription
             medications = []
@@ -432,40 +858,58 @@ Please enter your prescription:
 
         context.user_data['medications'] = medications
 
-        # Generate prescription preview
+        patient_id = context.user_data['selected_patient_id']
+        diagnosis = context.user_data['diagnosis']
         today = datetime.now().strftime("%d-%m-%Y")
 
-        # Get patient details
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT name, age FROM patients WHERE id = ?', (context.user_data['selected_patient_id'],))
-        patient = cursor.fetchone()
-        conn.close()
+        # Skip the DB lookup and re-render when the user resubmits the same
+        # prescription from the edit cycle. The key holds the full values
+        # (including the rendered date) rather than hashes: a hash collision
+        # would silently show the wrong preview
+        preview_key = (patient_id, today, diagnosis,
+                       tuple(tuple(med.items()) for med in medications))
+        if context.user_data.get('last_preview_key') == preview_key:
+            prescription_preview = context.user_data['last_preview_text']
+        else:
+            # Get patient details (memoized; patient rows are immutable)
+            patient = self._patient_name_cache.get(patient_id)
+            if patient is None:
+                async with self._acquire_read() as conn:
+                    async with conn.execute(SQL_PATIENT_DETAILS, (patient_id,)) as cursor:
+                        patient = await cursor.fetchone()
+                if patient is None:
+                    # A typed "... ID: n" message can pass _ID_RE without
+                    # naming a real patient; never cache the miss
+                    await update.message.reply_text(
+                        "❌ Patient not found. Please select a patient from the list."
+                    )
+                    return CONFIRM_PRESCRIPTION
+                self._patient_name_cache[patient_id] = patient
 
-        prescription_preview = f"""
+            parts = [f"""
 📋 **Prescription Preview**
 
 **Patient:** {patient[0]} (Age: {patient[1]})
-**Diagnosis:** {context.user_data['diagnosis']}
+**Diagnosis:** {diagnosis}
 **Date:** {today}
 
 **Medications:**
-"""
+"""]
 
-        for i, med in enumerate(medications, 1):
-            prescription_preview += f"""
+            parts.extend(f"""
 **{i}. {med['name']}**
    • Dosage: {med['dosage']}
    • Quantity: {med['quantity']}
    • Instructions: {med['instructions']}
-"""
+""" for i, med in enumerate(medications, 1))
 
-        keyboard = [['✅ Confirm & Save', '❌ Cancel', '✏️ Edit']]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            prescription_preview = "".join(parts)
+            context.user_data['last_preview_key'] = preview_key
+            context.user_data['last_preview_text'] = prescription_preview
 
         await update.message.reply_text(
             prescription_preview,
-            reply_markup=reply_markup,
+            reply_markup=self._CONFIRM_MARKUP,
             parse_mode='Markdown'
         )
 
@@ -475,37 +919,48 @@ Please enter your prescription:
         """Save prescription to database"""
         if update.message.text == '✅ Confirm & Save':
             # Save to database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
             today = datetime.now().date()
-            medications_json = json.dumps(context.user_data['medications'])
-
-            cursor.execute('''
-                INSERT INTO prescriptions (patient_id, diagnosis, admission_date, discharge_date, medications)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                context.user_data['selected_patient_id'],
-                context.user_data['diagnosis'],
-                today,
-                today,
-                medications_json
-            ))
-
-            prescription_id = cursor.lastrowid
+            medications = context.user_data['medications']
+            if medications is _HPYLORI_MEDS:
+                medications_json = _HPYLORI_JSON
+            else:
+                medications_json = orjson.dumps(medications).decode()
+
+            # Insert the prescription and its medication rows in one
+            # transaction: a single round-trip and fsync regardless of how
+            # many medications the prescription contains
+            async def insert_prescription(conn):
+                cursor = await conn.execute(SQL_INSERT_RX, (
+                    context.user_data['selected_patient_id'],
+                    update.effective_user.id,
+                    context.user_data['diagnosis'],
+                    today,
+                    today,
+                    medications_json,
+                    len(medications)
+                ))
+                rx_id = cursor.lastrowid
+                await conn.executemany(SQL_INSERT_MEDICATIONS,
+                                       [(rx_id, med['name'], med['dosage'], med['quantity'], med['instructions'])
+                                        for med in medications])
+                return rx_id
+
+            prescription_id = await self._write_transaction(insert_prescription)
+            self._invalidate_user_cache(update.effective_user.id)
 
             # Get patient details for PDF
-            cursor.execute('SELECT name, age FROM patients WHERE id = ?', (context.user_data['selected_patient_id'],))
-            patient = cursor.fetchone()
-            
-            conn.commit()
-            conn.close()
+            async with self._acquire_read() as conn:
+                async with conn.execute(SQL_PATIENT_DETAILS,
+                                        (context.user_data['selected_patient_id'],)) as cursor:
+                    patient = await cursor.fetchone()
 
-            # Generate PDF
+            # Generate PDF off the event loop; reportlab renders synchronously
+            # and would otherwise stall every other in-flight update
             try:
-                pdf_path = self.generate_prescription_pdf(
-                    patient[0], 
-                    patient[1], 
+                pdf_path = await asyncio.to_thread(
+                    self.generate_prescription_pdf,
+                    patient[0],
+                    patient[1],
                     context.user_data['diagnosis'],
                     context.user_data['medications'],
                     prescription_id
@@ -549,12 +1004,9 @@ The prescription has been saved to the database and PDF generated.
 The prescription has been saved to the database.
 """
 
-            keyboard = [['🏠 Main Menu', '💊 New Prescription']]
-            reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
             await update.message.reply_text(
                 success_message,
-                reply_markup=reply_markup,
+                reply_markup=self._AFTER_SAVE_MARKUP,
                 parse_mode='Markdown'
             )
 
@@ -570,78 +1022,105 @@ The prescription has been saved to the database.
         else:  # Cancel
             return await self.cancel(update, context)
 
-    async def view_patients(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def view_patients(self, update: Update, context: ContextTypes.DEFAULT_TYPE, cursor_key=None):
         """View all patients"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, name, age, phone, created_at FROM patients 
-            WHERE telegram_user_id = ? 
-            ORDER BY created_at DESC LIMIT 20
-        ''', (update.effective_user.id,))
+        user_id = update.effective_user.id
+        message = update.message or update.callback_query.message
 
-        patients = cursor.fetchall()
-        conn.close()
+        async def load_patients():
+            async with self._acquire_read() as conn:
+                if cursor_key is None:
+                    query, params = SQL_LIST_PATIENTS, (user_id,)
+                else:
+                    query, params = SQL_LIST_PATIENTS_AFTER, (user_id, *cursor_key)
+                async with conn.execute(query, params) as cursor:
+                    return await cursor.fetchall()
+
+        patients = await self._cached((user_id, 'patients', cursor_key), self.CACHE_TTL, load_patients)
 
         if not patients:
-            await update.message.reply_text("❌ No patients found.")
+            await message.reply_text(
+                "❌ No more patients." if cursor_key else "❌ No patients found.")
             return
 
-        patients_text = "👥 **Patient List:**\n\n"
+        parts = ["👥 **Patient List:**\n\n"]
 
-        for patient in patients:
-            try:
-                created_date = datetime.fromisoformat(patient[4]).strftime("%d-%m-%Y")
-            except:
-                created_date = patient[4]
-            patients_text += f"""
+        parts.extend(f"""
 **{patient[1]}** (ID: {patient[0]})
 🎂 Age: {patient[2]} years
 📱 Phone: {patient[3]}
-📅 Added: {created_date}
+📅 Added: {patient[5]}
 ---
-"""
+""" for patient in patients)
 
-        await update.message.reply_text(patients_text, parse_mode='Markdown')
+        # Offer the next page when this one is full, seeking past the last
+        # (created_at, id) shown so far
+        reply_markup = None
+        if len(patients) == PATIENTS_PAGE:
+            reply_markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton('➡️ Next',
+                                     callback_data=f'pts:{patients[-1][4]}|{patients[-1][0]}')
+            ]])
 
-    async def view_prescriptions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await message.reply_text("".join(parts), parse_mode='Markdown', reply_markup=reply_markup)
+
+    async def view_prescriptions(self, update: Update, context: ContextTypes.DEFAULT_TYPE, cursor_key=None):
         """View recent prescriptions"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.id, pt.name, p.diagnosis, p.admission_date, p.medications 
-            FROM prescriptions p
-            JOIN patients pt ON p.patient_id = pt.id
-            WHERE pt.telegram_user_id = ?
-            ORDER BY p.created_at DESC LIMIT 10
-        ''', (update.effective_user.id,))
-
-        prescriptions = cursor.fetchall()
-        conn.close()
+        user_id = update.effective_user.id
+        message = update.message or update.callback_query.message
+
+        async def load_prescriptions():
+            async with self._acquire_read() as conn:
+                if cursor_key is None:
+                    query, params = SQL_LIST_RX, (user_id,)
+                else:
+                    query, params = SQL_LIST_RX_AFTER, (user_id, *cursor_key)
+                async with conn.execute(query, params) as cursor:
+                    return await cursor.fetchall()
+
+        prescriptions = await self._cached((user_id, 'prescriptions', cursor_key),
+                                           self.CACHE_TTL, load_prescriptions)
 
         if not prescriptions:
-            await update.message.reply_text("❌ No prescriptions found.")
+            await message.reply_text(
+                "❌ No more prescriptions." if cursor_key else "❌ No prescriptions found.")
             return
 
-        prescriptions_text = "📋 **Recent Prescriptions:**\n\n"
+        parts = ["📋 **Recent Prescriptions:**\n\n"]
 
         for rx in prescriptions:
-            try:
-                medications = json.loads(rx[4])
-                med_count = len(medications)
-            except:
-                med_count = "Unknown"
+            med_count = rx[4] if rx[4] is not None else "Unknown"
 
-            prescriptions_text += f"""
+            parts.append(f"""
 **Prescription #{rx[0]}**
 👤 Patient: {rx[1]}
 🏥 Diagnosis: {rx[2]}
 📅 Date: {rx[3]}
 💊 Medications: {med_count} items
 ---
-"""
-
-        await update.message.reply_text(prescriptions_text, parse_mode='Markdown')
+""")
+
+        reply_markup = None
+        if len(prescriptions) == RX_PAGE:
+            reply_markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton('➡️ Next',
+                                     callback_data=f'rx:{prescriptions[-1][5]}|{prescriptions[-1][0]}')
+            ]])
+
+        await message.reply_text("".join(parts), parse_mode='Markdown', reply_markup=reply_markup)
+
+    async def paginate_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the inline Next buttons on the paginated list views"""
+        query = update.callback_query
+        await query.answer()
+
+        kind, _, payload = query.data.partition(':')
+        created_at, _, row_id = payload.rpartition('|')
+        cursor_key = (created_at, int(row_id))
+        if kind == 'pts':
+            await self.view_patients(update, context, cursor_key=cursor_key)
+        elif kind == 'rx':
+            await self.view_prescriptions(update, context, cursor_key=cursor_key)
 
     async def search_patient(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Search for patients"""
@@ -654,59 +1133,42 @@ The prescription has been saved to the database.
         """Handle patient search"""
         search_term = update.message.text.strip()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, name, age, phone FROM patients 
-            WHERE (name LIKE ? OR phone LIKE ?) AND telegram_user_id = ?
-        ''', (f'%{search_term}%', f'%{search_term}%', update.effective_user.id))
+        # Quoted prefix query so user input can't be parsed as FTS operators
+        match_query = '"{}"*'.format(search_term.replace('"', '""'))
 
-        results = cursor.fetchall()
-        conn.close()
+        async with self._acquire_read() as conn:
+            async with conn.execute(SQL_SEARCH,
+                                    (match_query, update.effective_user.id)) as cursor:
+                results = await cursor.fetchall()
 
         if not results:
             await update.message.reply_text(f"❌ No patients found matching '{search_term}'")
             return
 
-        results_text = f"🔍 **Search Results for '{search_term}':**\n\n"
+        parts = [f"🔍 **Search Results for '{search_term}':**\n\n"]
 
-        for patient in results:
-            results_text += f"""
+        parts.extend(f"""
 **{patient[1]}** (ID: {patient[0]})
-🎂 Age: {patient[2]} years  
+🎂 Age: {patient[2]} years
 📱 Phone: {patient[3]}
 ---
-"""
+""" for patient in results)
 
-        await update.message.reply_text(results_text, parse_mode='Markdown')
+        await update.message.reply_text("".join(parts), parse_mode='Markdown')
 
     async def statistics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Count patients
-        cursor.execute('SELECT COUNT(*) FROM patients WHERE telegram_user_id = ?', (update.effective_user.id,))
-        patient_count = cursor.fetchone()[0]
-
-        # Count prescriptions
-        cursor.execute('''
-            SELECT COUNT(*) FROM prescriptions p
-            JOIN patients pt ON p.patient_id = pt.id
-            WHERE pt.telegram_user_id = ?
-        ''', (update.effective_user.id,))
-        prescription_count = cursor.fetchone()[0]
-
-        # Today's prescriptions
+        user_id = update.effective_user.id
         today = datetime.now().date()
-        cursor.execute('''
-            SELECT COUNT(*) FROM prescriptions p
-            JOIN patients pt ON p.patient_id = pt.id
-            WHERE pt.telegram_user_id = ? AND DATE(p.created_at) = ?
-        ''', (update.effective_user.id, today))
-        today_prescriptions = cursor.fetchone()[0]
 
-        conn.close()
+        async def load_counts():
+            # Patient, prescription and today's counts in one round-trip
+            async with self._acquire_read() as conn:
+                async with conn.execute(SQL_STATS, (user_id, today)) as cursor:
+                    return await cursor.fetchone()
+
+        patient_count, prescription_count, today_prescriptions = await self._cached(
+            (user_id, 'statistics'), self.CACHE_TTL, load_counts)
 
         stats_text = f"""
 📊 **Medical Bot Statistics**
@@ -724,16 +1186,9 @@ The prescription has been saved to the database.
 
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancel current operation"""
-        keyboard = [
-            ['👤 Add New Patient', '📋 View Patients'],
-            ['💊 Create Prescription', '📊 View Prescriptions'],
-            ['🔍 Search Patient', '📈 Statistics']
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
         await update.message.reply_text(
             "❌ Operation cancelled. Back to main menu.",
-            reply_markup=reply_markup
+            reply_markup=self._MAIN_MENU_MARKUP
         )
         return ConversationHandler.END
 
@@ -765,11 +1220,7 @@ The prescription has been saved to the database.
             else:
                 await update.message.reply_text(
                     "Please select an option from the menu.",
-                    reply_markup=ReplyKeyboardMarkup([
-                        ['👤 Add New Patient', '📋 View Patients'],
-                        ['💊 Create Prescription', '📊 View Prescriptions'],
-                        ['🔍 Search Patient', '📈 Statistics']
-                    ], resize_keyboard=True)
+                    reply_markup=self._MAIN_MENU_MARKUP
                 )
 
     async def setup_webhook(self):
@@ -786,7 +1237,7 @@ The prescription has been saved to the database.
 
     def run_polling(self):
         """Run the bot in polling mode (for development)"""
-        application = Application.builder().token(self.token).build()
+        application = Application.builder().token(self.token).post_shutdown(self._on_shutdown).build()
         self.application = application
 
         # Conversation handler for adding patients and prescriptions
@@ -806,14 +1257,15 @@ The prescription has been saved to the database.
             },
             fallbacks=[
                 CommandHandler('cancel', self.cancel),
-                MessageHandler(filters.Regex(r'^🚫 Cancel), self.cancel),
-                MessageHandler(filters.Regex(r'^❌ Cancel), self.cancel)
+                MessageHandler(filters.Regex(r'^🚫 Cancel$'), self.cancel),
+                MessageHandler(filters.Regex(r'^❌ Cancel$'), self.cancel)
             ]
         )
 
         # Command handlers
         application.add_handler(CommandHandler("start", self.start))
         application.add_handler(conv_handler)
+        application.add_handler(CallbackQueryHandler(self.paginate_callback, pattern=r'^(pts|rx):'))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.button_handler))
 
         # Run the bot
@@ -824,14 +1276,14 @@ The prescription has been saved to the database.
     def run_webhook(self):
         """Run the bot in webhook mode (for Railway deployment)"""
         # Initialize the application
-        self.application = Application.builder().token(self.token).build()
+        self.application = Application.builder().token(self.token).post_shutdown(self._on_shutdown).build()
 
         # Conversation handler for adding patients and prescriptions
         conv_handler = ConversationHandler(
             entry_points=[
-                MessageHandler(filters.Regex(r'^👤 Add New Patient), self.add_patient_start),
-                MessageHandler(filters.Regex(r'^💊 Create Prescription), self.create_prescription_start),
-                MessageHandler(filters.Regex(r'^💊 New Prescription), self.create_prescription_start)
+                MessageHandler(filters.Regex(r'^👤 Add New Patient$'), self.add_patient_start),
+                MessageHandler(filters.Regex(r'^💊 Create Prescription$'), self.create_prescription_start),
+                MessageHandler(filters.Regex(r'^💊 New Prescription$'), self.create_prescription_start)
             ],
             states={
                 PATIENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.patient_name)],
@@ -843,14 +1295,15 @@ The prescription has been saved to the database.
             },
             fallbacks=[
                 CommandHandler('cancel', self.cancel),
-                MessageHandler(filters.Regex(r'^🚫 Cancel), self.cancel),
-                MessageHandler(filters.Regex(r'^❌ Cancel), self.cancel)
+                MessageHandler(filters.Regex(r'^🚫 Cancel$'), self.cancel),
+                MessageHandler(filters.Regex(r'^❌ Cancel$'), self.cancel)
             ]
         )
 
         # Command handlers
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(conv_handler)
+        self.application.add_handler(CallbackQueryHandler(self.paginate_callback, pattern=r'^(pts|rx):'))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.button_handler))
 
         # Setup webhook